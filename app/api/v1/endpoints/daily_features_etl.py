@@ -5,74 +5,126 @@
 # Endpoints:
 #   /etl_all_stocks: Calculate technical indicators for all stocks in a date range and batch upsert results.
 #   /etl_by_stock: Calculate technical indicators for a single stock in a date range and upsert results.
+#   /etl_by_stocks: Calculate technical indicators for a list of stocks in a date range and upsert results
+#                   in one transaction (replaces a client-side loop over /etl_by_stock).
 #
 # Features:
 # - Uses DailyFeatureETL for feature calculation (moving average, MACD, Bollinger Bands, etc.)
-# - Uses FeatureDaily.bulk_upsert_to_db for efficient batch upsert to Postgres
-# - Supports batch size control, logging, and error handling
-# - Returns upserted row count and calculated feature rows
+# - Uses FeatureDaily.bulk_upsert_frame to COPY the columnar result into Postgres
+# - Upserts all rows of a call and the updated indicator states in one transaction, with logging and error handling
+# - Shares one pooled database session per request via Depends(get_db)
+# - Async endpoints; blocking ETL and DB work runs in the threadpool so the event loop stays responsive
+# - Returns upserted row count; calculated feature rows are streamed as NDJSON on request
 #
 # Parameters:
 #   start_date, end_date: Date range for calculation (YYYY-MM-DD)
 #   stock_id: Stock symbol for single stock endpoint
+#   stock_ids: Repeated stock symbols for the multi-stock endpoint (e.g., ?stock_ids=2330&stock_ids=2317)
+#   include_rows: If true, stream the calculated rows as NDJSON instead of returning only the count
 #
 # Error Handling:
 #   All exceptions are logged and returned as HTTP 500 errors with details
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import orjson
 from datetime import date
+from typing import List
+from sqlalchemy.orm import Session
+from app.db.postgres import get_db
 from app.core.logger import logger
 from app.models.postgres_daily_features_etl import DailyFeatureETL
-from app.models.postgres_daily_features_orm import FeatureDaily
+from app.models.postgres_daily_features_orm import FeatureDaily, frame_to_records
 
 router = APIRouter()
 
+# Rows converted to dicts and encoded per streamed chunk of the NDJSON response
+NDJSON_CHUNK_ROWS = 10000
+
+
+def _iter_ndjson(rows):
+    """
+    Lazily encode calculated feature rows as NDJSON, NDJSON_CHUNK_ROWS rows at a time.
+    StreamingResponse iterates this sync generator in the threadpool, so the conversion never
+    runs on the event loop and only one chunk of row dicts is held in memory.
+
+    Args:
+        rows (pd.DataFrame): Calculated feature rows
+
+    Yields:
+        bytes: NDJSON lines of one chunk
+    """
+    for start in range(0, len(rows), NDJSON_CHUNK_ROWS):
+        records = frame_to_records(rows.iloc[start:start + NDJSON_CHUNK_ROWS])
+        yield b"".join(orjson.dumps(row) + b"\n" for row in records)
+
+
+def _rows_response(upserted, rows):
+    """
+    Stream calculated feature rows as NDJSON (one orjson-encoded row per line).
+    The upserted row count is returned in the X-Upserted-Rows header.
+
+    Args:
+        upserted (int): Number of rows upserted
+        rows (pd.DataFrame): Calculated feature rows
+
+    Returns:
+        StreamingResponse: application/x-ndjson response
+    """
+    return StreamingResponse(
+        _iter_ndjson(rows),
+        media_type="application/x-ndjson",
+        headers={"X-Upserted-Rows": str(upserted)},
+    )
+
 
 @router.get("/etl_all_stocks")
-def etl_all_stocks(
+async def etl_all_stocks(
     start_date: date = Query(..., description="Start date, format YYYY-MM-DD"),
-    end_date: date = Query(..., description="End date, format YYYY-MM-DD")
+    end_date: date = Query(..., description="End date, format YYYY-MM-DD"),
+    include_rows: bool = Query(False, description="Stream calculated rows as NDJSON"),
+    db: Session = Depends(get_db)
 ):
     """
     Batch calculate technical indicators for all stocks in the database within the specified date range.
-    Results are upserted to the feature_daily table in batches.
+    Results are upserted to the feature_daily table in a single transaction.
 
     Args:
         start_date (date): Start date for calculation (YYYY-MM-DD)
         end_date (date): End date for calculation (YYYY-MM-DD)
+        include_rows (bool): If true, stream the calculated rows as NDJSON
+        db (Session): Request-scoped database session (injected)
 
     Returns:
-        dict: {
-            'upserted': total number of rows upserted,
-            'rows': list of calculated feature dicts for all stocks
-        }
+        dict: {'upserted': total number of rows upserted}, or, if include_rows is true,
+            an NDJSON stream of calculated feature dicts for all stocks with the count
+            in the X-Upserted-Rows header
 
     Raises:
         HTTPException: 500 error with details if any exception occurs
     """
     try:
         logger.info(f"API etl_all_stocks called: {start_date} ~ {end_date}")
-        etl = DailyFeatureETL()
-        result = etl.etl_all_stocks(str(start_date), str(end_date))
-        total_upserted = 0
-        batch_size = 1000
-        for i in range(0, len(result), batch_size):
-            batch = result[i:i+batch_size]
-            upserted = FeatureDaily.bulk_upsert_to_db(batch)
-            total_upserted += upserted
-            logger.info(f"API etl_all_stocks: upserted batch {i//batch_size+1}, {upserted} rows.")
+        etl = DailyFeatureETL(session=db)
+        result = await run_in_threadpool(etl.etl_all_stocks, str(start_date), str(end_date))
+        total_upserted = await run_in_threadpool(FeatureDaily.bulk_upsert_frame, result, session=db)
         logger.info(f"API etl_all_stocks finished: {total_upserted} rows upserted.")
-        return {"upserted": total_upserted, "rows": result}
+        if include_rows:
+            return _rows_response(total_upserted, result)
+        return {"upserted": total_upserted}
     except Exception as e:
         logger.error(f"API etl_all_stocks error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/etl_by_stock")
-def etl_by_stock(
+async def etl_by_stock(
     stock_id: str = Query(..., description="Stock ID, e.g., 'AAPL'"),
     start_date: date = Query(None, description="Start date, format YYYY-MM-DD"),
-    end_date: date = Query(None, description="End date, format YYYY-MM-DD")
+    end_date: date = Query(None, description="End date, format YYYY-MM-DD"),
+    include_rows: bool = Query(False, description="Stream calculated rows as NDJSON"),
+    db: Session = Depends(get_db)
 ):
     """
     Calculate technical indicators for a single stock within the specified date range.
@@ -82,24 +134,73 @@ def etl_by_stock(
         stock_id (str): Stock symbol to calculate (e.g., 'AAPL')
         start_date (date, optional): Start date for calculation (YYYY-MM-DD)
         end_date (date, optional): End date for calculation (YYYY-MM-DD)
+        include_rows (bool): If true, stream the calculated rows as NDJSON
+        db (Session): Request-scoped database session (injected)
 
     Returns:
-        dict: {
-            'upserted': number of rows upserted,
-            'rows': list of calculated feature dicts for the stock
-        }
+        dict: {'upserted': number of rows upserted}, or, if include_rows is true,
+            an NDJSON stream of calculated feature dicts for the stock with the count
+            in the X-Upserted-Rows header
 
     Raises:
         HTTPException: 500 error with details if any exception occurs
     """
     try:
         logger.info(f"API etl_by_stock called: {stock_id} {start_date} ~ {end_date}")
-        etl = DailyFeatureETL()
-        result = etl.etl_by_stock(stock_id, str(start_date) if start_date else None, str(end_date) if end_date else None)
-        upserted = FeatureDaily.bulk_upsert_to_db(result)
+        etl = DailyFeatureETL(session=db)
+        result = await run_in_threadpool(
+            etl.etl_by_stock, stock_id, str(start_date) if start_date else None, str(end_date) if end_date else None
+        )
+        upserted = await run_in_threadpool(FeatureDaily.bulk_upsert_frame, result, session=db)
         logger.info(f"API etl_by_stock finished: {upserted} rows upserted.")
-        return {"upserted": upserted, "rows": result}
+        if include_rows:
+            return _rows_response(upserted, result)
+        return {"upserted": upserted}
     except Exception as e:
         logger.error(f"API etl_by_stock error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.get("/etl_by_stocks")
+async def etl_by_stocks(
+    stock_ids: List[str] = Query(..., description="Stock IDs, repeat the parameter for each stock"),
+    start_date: date = Query(None, description="Start date, format YYYY-MM-DD"),
+    end_date: date = Query(None, description="End date, format YYYY-MM-DD"),
+    include_rows: bool = Query(False, description="Stream calculated rows as NDJSON"),
+    db: Session = Depends(get_db)
+):
+    """
+    Calculate technical indicators for a list of stocks within the specified date range.
+    Kline rows are fetched with one query per chunk of stocks and all results are upserted
+    to the feature_daily table in a single transaction, so calling this once costs a few
+    database round trips instead of several per stock.
+
+    Args:
+        stock_ids (List[str]): Stock symbols to calculate
+        start_date (date, optional): Start date for calculation (YYYY-MM-DD)
+        end_date (date, optional): End date for calculation (YYYY-MM-DD)
+        include_rows (bool): If true, stream the calculated rows as NDJSON
+        db (Session): Request-scoped database session (injected)
+
+    Returns:
+        dict: {'upserted': number of rows upserted}, or, if include_rows is true,
+            an NDJSON stream of calculated feature dicts for the stocks with the count
+            in the X-Upserted-Rows header
+
+    Raises:
+        HTTPException: 500 error with details if any exception occurs
+    """
+    try:
+        logger.info(f"API etl_by_stocks called: {len(stock_ids)} stocks {start_date} ~ {end_date}")
+        etl = DailyFeatureETL(session=db)
+        result = await run_in_threadpool(
+            etl.etl_by_stocks, stock_ids, str(start_date) if start_date else None, str(end_date) if end_date else None
+        )
+        upserted = await run_in_threadpool(FeatureDaily.bulk_upsert_frame, result, session=db)
+        logger.info(f"API etl_by_stocks finished: {upserted} rows upserted.")
+        if include_rows:
+            return _rows_response(upserted, result)
+        return {"upserted": upserted}
+    except Exception as e:
+        logger.error(f"API etl_by_stocks error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
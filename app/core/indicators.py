@@ -0,0 +1,192 @@
+"""
+Numba-compiled technical indicator kernel.
+
+All daily features (MA5, EMA12/26, MACD, Bollinger Bands and breakout flags) are
+computed in one pass over the close price array, replacing the chained pandas
+rolling/ewm operations that each allocated and walked a separate Series.
+
+Semantics:
+    - ma5 / bb_ma20 / bb_std20: NaN until the window is full, std uses ddof=1
+      (same as pandas rolling)
+    - ema12 / ema26 / macd_dea: recursive EMA, ema = ema + alpha * (x - ema), seeded with the
+      SMA of the first N observations; NaN before the seed index (11 for EMA12, 25 for EMA26,
+      33 for MACD DEA), so every emitted value is free of first-observation bias
+    - NaN closes are skipped by the EMAs (the previous value is carried over, as pandas
+      ewm(adjust=False, ignore_na=True)) and make MA5 / Bollinger values NaN while inside the window
+    - bb_break_up / bb_break_dn: int8 flags, 1 = True, 0 = False, -1 = unknown while the band is still undefined
+
+compute_from_state() continues the same recursion from a persisted state (last
+BB_WINDOW closes plus the EMA12/EMA26/MACD-DEA values), so an incremental run only
+touches the newly arrived closes.
+
+Usage:
+    from app.core.indicators import compute_all
+    ma5, ema12, ... = compute_all(df['close'].to_numpy(dtype=np.float64))
+"""
+import numpy as np
+from numba import njit
+
+MA_WINDOW = 5
+BB_WINDOW = 20
+BB_K = 2.0
+EMA_FAST = 12
+EMA_SLOW = 26
+EMA_SIGNAL = 9
+
+# Names of the arrays returned by compute_all, in return order
+INDICATOR_COLUMNS = (
+    'ma5', 'ema12', 'ema26', 'macd_dif', 'macd_dea', 'macd_osc',
+    'bb_ma20', 'bb_std20', 'bb_upper20', 'bb_lower20', 'bb_width20', 'bb_pos20',
+    'bb_break_up', 'bb_break_dn',
+)
+
+
+@njit(cache=True)
+def compute_all(close):
+    """
+    Compute all daily technical indicators for one stock's close series.
+
+    Args:
+        close (np.ndarray): float64 close prices, ordered by date ascending
+
+    Returns:
+        tuple: Indicator arrays in INDICATOR_COLUMNS order, see compute_from_state
+    """
+    return compute_from_state(close, np.empty(0), np.nan, np.nan, np.nan)
+
+
+@njit(cache=True)
+def compute_from_state(close, history, ema12_prev, ema26_prev, macd_dea_prev):
+    """
+    Compute daily technical indicators for new closes, continuing from a previous state.
+
+    Args:
+        close (np.ndarray): float64 new close prices, ordered by date ascending
+        history (np.ndarray): float64 closes preceding `close` (only the last BB_WINDOW are used)
+        ema12_prev, ema26_prev, macd_dea_prev (float): EMA values on the last history day,
+            NaN to seed the EMA with the SMA of its first N inputs from `close`
+
+    Returns:
+        tuple: (ma5, ema12, ema26, macd_dif, macd_dea, macd_osc,
+                bb_ma20, bb_std20, bb_upper20, bb_lower20, bb_width20, bb_pos20,
+                bb_break_up, bb_break_dn)
+            Float indicators are float64 arrays, breakout flags are int8 arrays (1/0, -1 = unknown).
+    """
+    n = close.shape[0]
+    ma5 = np.full(n, np.nan)
+    ema12 = np.empty(n)
+    ema26 = np.empty(n)
+    macd_dif = np.empty(n)
+    macd_dea = np.empty(n)
+    macd_osc = np.empty(n)
+    bb_ma20 = np.full(n, np.nan)
+    bb_std20 = np.full(n, np.nan)
+    bb_upper20 = np.full(n, np.nan)
+    bb_lower20 = np.full(n, np.nan)
+    bb_width20 = np.full(n, np.nan)
+    bb_pos20 = np.full(n, np.nan)
+    bb_break_up = np.full(n, -1, dtype=np.int8)
+    bb_break_dn = np.full(n, -1, dtype=np.int8)
+    if n == 0:
+        return (ma5, ema12, ema26, macd_dif, macd_dea, macd_osc,
+                bb_ma20, bb_std20, bb_upper20, bb_lower20, bb_width20, bb_pos20,
+                bb_break_up, bb_break_dn)
+
+    a_fast = 2.0 / (EMA_FAST + 1)
+    a_slow = 2.0 / (EMA_SLOW + 1)
+    a_signal = 2.0 / (EMA_SIGNAL + 1)
+
+    # Circular buffer holding the last BB_WINDOW closes, indexed by position t
+    # in the combined (history + close) series
+    window = np.empty(BB_WINDOW)
+    tail = history[max(history.shape[0] - BB_WINDOW, 0):]
+    h = tail.shape[0]
+    for t in range(h):
+        window[t % BB_WINDOW] = tail[t]
+
+    # NaN previous values mean "not seeded yet": the EMA is then seeded with the SMA of
+    # its first N valid inputs from `close`. Seeding is tracked with explicit counters, so
+    # NaN is never used as a sentinel once a series has been seeded.
+    e_fast = ema12_prev
+    e_slow = ema26_prev
+    e_signal = macd_dea_prev
+    n_fast = EMA_FAST if not np.isnan(e_fast) else 0
+    n_slow = EMA_SLOW if not np.isnan(e_slow) else 0
+    n_signal = EMA_SIGNAL if not np.isnan(e_signal) else 0
+    sum_fast = 0.0
+    sum_slow = 0.0
+    sum_signal = 0.0
+    for i in range(n):
+        c = close[i]
+        t = h + i
+        window[t % BB_WINDOW] = c
+
+        # A NaN close (missing kline value) leaves the EMAs unchanged, like pandas
+        # ewm(adjust=False, ignore_na=True): the previous value is carried over.
+        if not np.isnan(c):
+            if n_fast < EMA_FAST:
+                sum_fast += c
+                n_fast += 1
+                if n_fast == EMA_FAST:
+                    e_fast = sum_fast / EMA_FAST
+            else:
+                e_fast = e_fast + a_fast * (c - e_fast)
+            if n_slow < EMA_SLOW:
+                sum_slow += c
+                n_slow += 1
+                if n_slow == EMA_SLOW:
+                    e_slow = sum_slow / EMA_SLOW
+            else:
+                e_slow = e_slow + a_slow * (c - e_slow)
+            if n_fast == EMA_FAST and n_slow == EMA_SLOW:
+                dif = e_fast - e_slow
+                if n_signal < EMA_SIGNAL:
+                    sum_signal += dif
+                    n_signal += 1
+                    if n_signal == EMA_SIGNAL:
+                        e_signal = sum_signal / EMA_SIGNAL
+                else:
+                    e_signal = e_signal + a_signal * (dif - e_signal)
+        dif = e_fast - e_slow
+        ema12[i] = e_fast
+        ema26[i] = e_slow
+        macd_dif[i] = dif
+        macd_dea[i] = e_signal
+        macd_osc[i] = dif - e_signal
+
+        if t >= MA_WINDOW - 1:
+            s = 0.0
+            for k in range(MA_WINDOW):
+                s += window[(t - k) % BB_WINDOW]
+            ma5[i] = s / MA_WINDOW
+
+        if t >= BB_WINDOW - 1:
+            # Mean and variance are taken from the buffer rather than from running
+            # sums so long series do not accumulate cancellation error.
+            s = 0.0
+            for k in range(BB_WINDOW):
+                s += window[k]
+            mean = s / BB_WINDOW
+            if np.isnan(mean):
+                # A NaN close inside the window leaves the band undefined, as with pandas rolling
+                continue
+            ss = 0.0
+            for k in range(BB_WINDOW):
+                d = window[k] - mean
+                ss += d * d
+            std = np.sqrt(ss / (BB_WINDOW - 1))
+            upper = mean + BB_K * std
+            lower = mean - BB_K * std
+            width = upper - lower
+            bb_ma20[i] = mean
+            bb_std20[i] = std
+            bb_upper20[i] = upper
+            bb_lower20[i] = lower
+            bb_width20[i] = width
+            bb_pos20[i] = (c - lower) / (width + 1e-9)
+            bb_break_up[i] = 1 if c > upper else 0
+            bb_break_dn[i] = 1 if c < lower else 0
+
+    return (ma5, ema12, ema26, macd_dif, macd_dea, macd_osc,
+            bb_ma20, bb_std20, bb_upper20, bb_lower20, bb_width20, bb_pos20,
+            bb_break_up, bb_break_dn)
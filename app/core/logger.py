@@ -22,15 +22,15 @@ log_file_pattern = os.path.join(
 # Remove default logger to avoid duplicate logs
 logger.remove()
 
-# Add new logger with rotation at midnight and retention for 30 days
+# Add new logger with rotation at midnight and retention for 30 days.
+# backtrace/diagnose are left off: they walk and format stack frames and variable values,
+# which is costly on hot paths and can leak data into log files.
 logger.add(
     log_file_pattern,
     rotation="00:00",
     retention="30 days",
     encoding="utf-8",
     enqueue=True,
-    backtrace=True,
-    diagnose=True,
     level="INFO"
 )
 
@@ -21,6 +21,11 @@ class Settings(BaseSettings):
     POSTGRES_TABLE: str  # PostgreSQL table name
     POSTGRES_STOCK_INFO: str  # PostgreSQL stock info table name
     POSTGRES_KLINE: str  # PostgreSQL kline table name
+    POSTGRES_FEATURE_STATE: str = "daily_features_state"  # PostgreSQL incremental indicator state table name
+    # Connection pool limits apply per uvicorn worker process: workers * (POOL_SIZE + MAX_OVERFLOW)
+    # must stay below Postgres max_connections
+    POSTGRES_POOL_SIZE: int = 20  # Persistent connections kept in the SQLAlchemy pool
+    POSTGRES_MAX_OVERFLOW: int = 40  # Extra connections allowed above the pool size under load
 
     # Use ConfigDict for pydantic v2+ configuration
     model_config = ConfigDict(env_file=".env")
@@ -35,6 +40,14 @@ def _load_settings() -> Settings:
         print("[Settings Validation Error]", e)
         raise
 
+# Process-wide settings cache used when DEBUG_MODE is False
+@lru_cache(maxsize=1)
+def _cached_settings() -> Settings:
+    return _load_settings()
+
+# DEBUG_MODE from the environment, read once at import; None if not set
+_ENV_DEBUG_MODE = os.getenv("DEBUG_MODE")
+
 # Main accessor for settings
 # If DEBUG_MODE is True, always reload settings for dynamic development
 # If DEBUG_MODE is False, cache the settings instance for best performance
@@ -44,22 +57,17 @@ def get_settings() -> Settings:
     - If DEBUG_MODE is True, always reload from .env (dynamic, for development).
     - If DEBUG_MODE is False, cache the instance (static, for production).
     """
-    debug = os.getenv("DEBUG_MODE")
-    if debug is None:
-        # If DEBUG_MODE is not set in the environment, use the default from Settings
-        debug = _load_settings().DEBUG_MODE
+    if _ENV_DEBUG_MODE is None:
+        # If DEBUG_MODE is not set in the environment, use the value from the cached Settings
+        debug = _cached_settings().DEBUG_MODE
     else:
         # Convert string to boolean
-        debug = debug.lower() in ("1", "true", "yes", "on")
+        debug = _ENV_DEBUG_MODE.lower() in ("1", "true", "yes", "on")
     if debug:
         # Development mode: always reload settings
         return _load_settings()
-    else:
-        # Production mode: cache settings for performance
-        @lru_cache()
-        def cached():
-            return _load_settings()
-        return cached()
+    # Production mode: settings are parsed once per process
+    return _cached_settings()
 
 # Global settings instance for direct import and usage across the project
 # Usage: from app.core.setups import settings
@@ -3,42 +3,105 @@
 # Database connection, session, and table creation utilities for Postgres.
 #
 # Features:
-# - Creates SQLAlchemy engine and session for Postgres
+# - Creates SQLAlchemy engine (with a tuned connection pool) and session for Postgres
+# - Provides get_db() FastAPI dependency to share one session per request
 # - Defines declarative base for ORM models
 # - Provides ensure_table_exists() to auto-create feature_daily table if missing
+# - Provides ensure_feature_state_table_exists() to auto-create the incremental indicator state table
+# - Provides ensure_kline_indexes() to create the (stock_id, date) index used by kline range queries (concurrently)
 # - Uses environment settings for connection parameters
 #
 # Usage:
 #   Import engine, SessionLocal, Base for ORM and DB operations
-#   Call ensure_table_exists() at startup to guarantee table exists
+#   Use Depends(get_db) in endpoints and pass the session to model helpers
+#   Call ensure_table_exists() and ensure_feature_state_table_exists() at startup to guarantee tables exist
 #
 # Functions:
+#   get_db(): Yields one session per request and closes it afterwards
+#   session_scope(session): Reuses the given session, or opens and closes a new one
 #   ensure_table_exists(): Checks and creates feature_daily table if not present
+#   ensure_feature_state_table_exists(): Checks and creates feature state table if not present
+#   ensure_kline_indexes(): Creates the kline (stock_id, date) index if not present
 #
 # Returns:
 #   engine: SQLAlchemy engine instance
 #   SessionLocal: sessionmaker for DB sessions
 #   Base: declarative base for ORM
 #   ensure_table_exists: function to check/create table
+#   ensure_feature_state_table_exists: function to check/create state table
+#   ensure_kline_indexes: function to create kline indexes
 
 from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+from contextlib import contextmanager
 from app.core.setups import settings
+from app.core.logger import logger
 from datetime import date
 
 Base = declarative_base()
 
-__all__ = ["engine", "SessionLocal", "ensure_table_exists", "Base"]
+__all__ = [
+    "engine", "SessionLocal", "get_db", "session_scope",
+    "ensure_table_exists", "ensure_feature_state_table_exists", "ensure_kline_indexes", "Base",
+]
 
 POSTGRES_URL = (
     f"postgresql://{settings.POSTGRES_USER}:{settings.POSTGRES_PASSWORD}"
     f"@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}"
 )
 
-engine = create_engine(POSTGRES_URL, echo=False, future=True)
+# Pool sized for concurrent API requests; pre-ping and recycle drop connections
+# closed by the server or network middleboxes before they are handed out.
+engine = create_engine(
+    POSTGRES_URL,
+    echo=False,
+    future=True,
+    pool_size=settings.POSTGRES_POOL_SIZE,
+    max_overflow=settings.POSTGRES_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def get_db():
+    """
+    FastAPI dependency yielding one database session per request.
+
+    Usage:
+        def endpoint(db: Session = Depends(get_db)): ...
+
+    Yields:
+        Session: SQLAlchemy session, closed after the request finishes
+    """
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@contextmanager
+def session_scope(session=None):
+    """
+    Context manager for model helpers that accept an optional session.
+    A given session is reused and left open for its owner; otherwise a new session
+    is opened and closed on exit.
+
+    Args:
+        session (Session, optional): Caller-owned session to reuse
+
+    Yields:
+        Session: SQLAlchemy session
+    """
+    if session is not None:
+        yield session
+        return
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
 def ensure_table_exists():
     """
     Ensure the feature_daily table exists in the Postgres database.
@@ -92,3 +155,81 @@ def ensure_table_exists():
         conn.commit()
     inspector = inspect(engine)
     return table_name in inspector.get_table_names()
+
+
+def ensure_feature_state_table_exists():
+    """
+    Ensure the incremental indicator state table exists in the Postgres database.
+    The table keeps, per stock, the recursive indicator state after the last calculated day,
+    so single-day ETL can advance indicators from new kline rows only.
+
+    Table schema:
+        - stock_id: TEXT, primary key
+        - last_date: DATE, last trade date included in the state
+        - ema12, ema26, macd_dea: DOUBLE PRECISION, EMA values on last_date
+        - window20: DOUBLE PRECISION[], last 20 closes up to last_date (oldest first)
+        - updated_at: TIMESTAMP
+
+    Returns:
+        bool: True if table exists or was created successfully, False otherwise
+    """
+    table_name = getattr(settings, "POSTGRES_FEATURE_STATE", "daily_features_state")
+    inspector = inspect(engine)
+    if table_name in inspector.get_table_names():
+        return True
+    create_sql = f'''
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        stock_id         TEXT        NOT NULL,
+        last_date        DATE        NOT NULL,
+        ema12            DOUBLE PRECISION,
+        ema26            DOUBLE PRECISION,
+        macd_dea         DOUBLE PRECISION,
+        window20         DOUBLE PRECISION[] NOT NULL,
+        updated_at       TIMESTAMP DEFAULT NOW(),
+        CONSTRAINT feature_state_pkey PRIMARY KEY (stock_id)
+    );
+    '''
+    with engine.connect() as conn:
+        conn.execute(text(create_sql))
+        conn.commit()
+    inspector = inspect(engine)
+    return table_name in inspector.get_table_names()
+
+def ensure_kline_indexes():
+    """
+    Ensure the kline table has a composite B-tree index on (stock_id, date).
+    Kline queries filter by stock_id and a date range and sort by date, which the index
+    serves as an ordered range scan instead of a sequential scan plus sort.
+
+    The index is built with CREATE INDEX CONCURRENTLY on an autocommit connection, so writes to
+    the kline table are not blocked during the first build. An INVALID index left behind by an
+    interrupted concurrent build is dropped and rebuilt. Errors are logged instead of raised,
+    since the function runs in a background thread at startup.
+
+    Returns:
+        bool: True if the index exists or was created successfully, False otherwise
+    """
+    table_name = getattr(settings, "POSTGRES_KLINE", "kline")
+    # Only an index on the kline table itself counts; a same-named index in another schema is ignored
+    valid_sql = '''
+    SELECT n.nspname, i.indisvalid FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relname = 'ix_kline_stock_date' AND i.indrelid = to_regclass(:table_name);
+    '''
+    create_sql = f'''
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_kline_stock_date ON {table_name} (stock_id, date);
+    '''
+    try:
+        # CONCURRENTLY cannot run inside a transaction block
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            existing = conn.execute(text(valid_sql), {"table_name": table_name}).first()
+            if existing is not None and not existing.indisvalid:
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{existing.nspname}".ix_kline_stock_date;'))
+            conn.execute(text(create_sql))
+        inspector = inspect(engine)
+        return any(ix["name"] == "ix_kline_stock_date" for ix in inspector.get_indexes(table_name))
+    except Exception as e:
+        # Runs in a background thread at startup, so failures must be logged here to be seen
+        logger.error(f"ensure_kline_indexes: creating ix_kline_stock_date on {table_name} failed: {e}")
+        return False
@@ -14,8 +14,9 @@ Key Components:
 
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
+import threading
 from app.api.v1.endpoints import daily_features_etl
-from app.db.postgres import ensure_table_exists
+from app.db.postgres import ensure_table_exists, ensure_feature_state_table_exists, ensure_kline_indexes
 
 
 @asynccontextmanager
@@ -24,7 +25,9 @@ async def lifespan(app: FastAPI):
     Application lifespan event handler.
 
     This function is executed at application startup and shutdown.
-    At startup, it ensures that all required database tables exist by calling ensure_table_exists().
+    At startup, it ensures that all required database tables exist by calling ensure_table_exists()
+    and ensure_feature_state_table_exists(). The kline index is built by ensure_kline_indexes() in a
+    background thread, since its first build can take long on a large kline table.
     The yield statement allows FastAPI to continue serving requests until shutdown.
 
     Args:
@@ -34,6 +37,8 @@ async def lifespan(app: FastAPI):
         None
     """
     ensure_table_exists()
+    ensure_feature_state_table_exists()
+    threading.Thread(target=ensure_kline_indexes, name="ensure_kline_indexes", daemon=True).start()
     yield
 
 
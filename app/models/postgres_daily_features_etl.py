@@ -1,165 +1,358 @@
 
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import uuid
-from app.models.postgres_kline import get_kline
+from itertools import islice
+from app.models.postgres_kline import get_kline, get_kline_multi
 from app.models.postgres_stock_info import get_all_stock_ids
-from app.db.postgres import engine
+from app.models.postgres_feature_state import get_feature_state, get_feature_states, upsert_feature_states
 from sqlalchemy.dialects.postgresql import insert
-from app.db.postgres import SessionLocal
 from app.core.logger import logger
+from app.core.indicators import compute_all, compute_from_state, INDICATOR_COLUMNS, BB_WINDOW
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 
+# Calendar days of kline fetched before start_date for calculations without a usable state.
+# The warm-up rows only seed the indicators and are not returned for upsert.
+# MACD DEA is first defined after EMA_SLOW + EMA_SIGNAL - 1 = 34 trading days (SMA-seeded EMAs),
+# about 48 calendar days, plus margin for market holidays.
+WARMUP_CALENDAR_DAYS = 70
+
+# Number of stocks whose kline rows are fetched per query in batch ETL
+ETL_FETCH_CHUNK_SIZE = 1000
+
+# Kline columns read by the ETL; the indicator calculation only needs the close series and its dates
+KLINE_COLUMNS = ('date', 'close')
+
+# Output columns of one feature row, in feature_daily table order.
+# created_at/updated_at are omitted and stamped by the database.
+FEATURE_COLUMNS = [
+    'stock_id', 'trade_date',
+    'ma5', 'ema12', 'ema26', 'macd_dif', 'macd_dea', 'macd_osc',
+    'bb_ma20', 'bb_std20', 'bb_upper20', 'bb_lower20', 'bb_width20', 'bb_pos20',
+    'bb_break_up', 'bb_break_dn',
+    'etl_run_id', 'source_version', 'commit_sha',
+]
 
 class DailyFeatureETL:
     """
     ETL class for calculating daily technical indicators for stocks and preparing data for bulk upsert.
 
     Features:
-    - Fetches kline (OHLCV) data for stocks from the database
+    - Fetches kline (date, close) data for stocks from the database
     - Calculates daily features: moving averages (MA, EMA), MACD, Bollinger Bands, breakout flags, etc.
     - Prepares results for bulk upsert to feature_daily table
     - Supports batch calculation for all stocks or single stock
 
-    Methods:
-        calculate_features(stock_id, df):
-            Calculate technical indicators for a given stock's kline DataFrame.
-            Features include MA5, EMA12, EMA26, MACD (DIF, DEA, OSC), Bollinger Bands (MA20, STD20, upper/lower/width/pos),
-            and breakout flags (bb_break_up, bb_break_dn).
-            Returns a DataFrame with all calculated features.
+    Features calculated (see app.core.indicators):
+        - ma5: 5-day moving average of close price
+        - ema12, ema26: 12/26-day exponential moving averages, seeded with the SMA of the first 12/26 closes
+        - macd_dif, macd_dea, macd_osc: MACD indicators
+        - bb_ma20, bb_std20: 20-day Bollinger Band mean and std
+        - bb_upper20, bb_lower20: Bollinger Band upper/lower
+        - bb_width20: Band width
+        - bb_pos20: Position of close within band
+        - bb_break_up: True if close > upper band (breakout), <NA> while the band is undefined
+        - bb_break_dn: True if close < lower band (breakdown), <NA> while the band is undefined
 
+    Methods:
         etl_by_stock(stock_id, start_date, end_date):
-            Fetch kline data for a single stock and date range, calculate features, and prepare dicts for upsert.
-            Returns a list of dicts, each representing one day's features.
+            Fetch kline data for a single stock and date range, calculate features, and prepare a DataFrame for upsert.
+            Single-day runs advance a stored indicator state incrementally when one is available.
+            Returns a DataFrame, each row representing one day's features.
 
         etl_all_stocks(start_date, end_date):
-            Batch process all stocks in the database for the given date range.
-            Returns a list of dicts for all stocks and dates.
+            Batch process all stocks in the database for the given date range, fetching kline with one query per chunk.
+            Returns a DataFrame for all stocks and dates.
+
+        etl_by_stocks(stock_ids, start_date, end_date):
+            Same batch processing for a given list of stocks (duplicates are ignored).
     """
-    def __init__(self, etl_run_id=None, source_version=None, commit_sha=None):
+    def __init__(self, etl_run_id=None, source_version=None, commit_sha=None, session=None):
         self.etl_run_id = etl_run_id or uuid.uuid4()
+        # Optional caller-owned session (e.g., the request session) shared by all DB helpers
+        self.session = session
         self.source_version = source_version
         self.commit_sha = commit_sha
     pass
 
-    def calculate_features(self, stock_id, df):
+    def etl_by_stock(self, stock_id, start_date=None, end_date=None):
         """
-        Calculate daily technical indicators for a given stock's kline DataFrame.
+        ETL for a single stock: fetch kline data, calculate features, prepare a DataFrame for upsert.
+
+        For a single-day run (start_date == end_date) with a stored indicator state older than that day,
+        only kline rows after the state's last date are fetched and the indicators are advanced from the state.
+        Otherwise WARMUP_CALENDAR_DAYS of kline before start_date are fetched as well, so EMA26/MACD DEA
+        are already seeded on start_date, and only rows from start_date on are returned.
+        The new indicator state is written in the ETL session without committing, so it is committed
+        together with the feature rows by bulk_upsert_frame (pass the same session to both).
 
         Args:
             stock_id (str): Stock symbol
-            df (pd.DataFrame): Kline data with columns: date, open, high, low, close, trading_volume, etc.
+            start_date (str): Start date (YYYY-MM-DD)
+            end_date (str): End date (YYYY-MM-DD)
 
         Returns:
-            pd.DataFrame: DataFrame with calculated features for each day
-
-        Features calculated:
-            - ma5: 5-day moving average of close price
-            - ema12, ema26: 12/26-day exponential moving averages
-            - macd_dif, macd_dea, macd_osc: MACD indicators
-            - bb_ma20, bb_std20: 20-day Bollinger Band mean and std
-            - bb_upper20, bb_lower20: Bollinger Band upper/lower
-            - bb_width20: Band width
-            - bb_pos20: Position of close within band
-            - bb_break_up: True if close > upper band (breakout)
-            - bb_break_dn: True if close < lower band (breakdown)
-        """
-        df = df.copy()
-        df['ma5'] = df['close'].rolling(window=5).mean()
-        df['ema12'] = df['close'].ewm(span=12, adjust=False).mean()
-        df['ema26'] = df['close'].ewm(span=26, adjust=False).mean()
-        df['macd_dif'] = df['ema12'] - df['ema26']
-        df['macd_dea'] = df['macd_dif'].ewm(span=9, adjust=False).mean()
-        df['macd_osc'] = df['macd_dif'] - df['macd_dea']
-        df['bb_ma20'] = df['close'].rolling(window=20).mean()
-        df['bb_std20'] = df['close'].rolling(window=20).std()
-        df['bb_upper20'] = df['bb_ma20'] + 2 * df['bb_std20']
-        df['bb_lower20'] = df['bb_ma20'] - 2 * df['bb_std20']
-        df['bb_width20'] = df['bb_upper20'] - df['bb_lower20']
-        df['bb_pos20'] = (df['close'] - df['bb_lower20']) / (df['bb_width20'] + 1e-9)
-        df['bb_break_up'] = df['close'] > df['bb_upper20']
-        df['bb_break_dn'] = df['close'] < df['bb_lower20']
-        return df
+            pd.DataFrame: One row per day with FEATURE_COLUMNS, NaN marks NULL values
+        """
+        state = None
+        if start_date == end_date and start_date is not None:
+            state = get_feature_state(stock_id, session=self.session)
+            if not self._is_state_usable(state, datetime.strptime(start_date, "%Y-%m-%d").date()):
+                state = None
+        if state is not None:
+            # Incremental path: only kline rows after the state's last date are needed
+            next_date = (state.last_date + timedelta(days=1)).strftime("%Y-%m-%d")
+            logger.debug("etl_by_stock: Fetching kline for {} from {} to {} for incremental calculation.", stock_id, next_date, end_date)
+            df = get_kline(stock_id, next_date, end_date, columns=KLINE_COLUMNS, session=self.session)
+        else:
+            fetch_start = self._warmup_start(start_date)
+            logger.debug("etl_by_stock: Fetching kline for {} from {} to {} for feature calculation.", stock_id, fetch_start, end_date)
+            df = get_kline(stock_id, fetch_start, end_date, columns=KLINE_COLUMNS, session=self.session)
+        logger.debug("etl_by_stock: Fetched {} kline records for {}.", len(df), stock_id)
+        if df.empty:
+            logger.warning(f"etl_by_stock: No kline data for {stock_id}, skipped.")
+            return pd.DataFrame(columns=FEATURE_COLUMNS)
+        result, new_states = self._calculate_chunk(
+            df.assign(stock_id=stock_id), {stock_id: state} if state is not None else {}, start_date
+        )
+        upsert_feature_states(new_states, session=self.session)
+        logger.info(f"etl_by_stock: Feature calculation for {stock_id} {end_date} finished, total {len(result)} rows.")
+        return result
 
-    def etl_by_stock(self, stock_id, start_date=None, end_date=None):
+    def _calculate_chunk(self, kline, states, start_date=None):
         """
-        ETL for a single stock: fetch kline data, calculate features, prepare dicts for upsert.
+        Calculate features for the kline rows of one or more stocks and shape them for upsert.
+        The Numba kernel runs on each stock's slice of the raw close array and fills chunk-wide
+        output arrays, so a single DataFrame is built per chunk instead of one per stock.
+
+        Args:
+            kline (pd.DataFrame): Columns stock_id, date, close, ordered by stock_id and date ascending
+            states (dict): Usable FeatureState per stock_id; rows up to a state's last_date are skipped
+                and the indicators continue from the state
+            start_date (str, optional): First date to return (YYYY-MM-DD); earlier rows of stocks without
+                a state are warm-up rows that only seed the indicators
+
+        Returns:
+            tuple: (pd.DataFrame with FEATURE_COLUMNS, NaN marks NULL values; list of next state dicts)
+        """
+        stock_ids = kline['stock_id'].to_numpy()
+        dates = kline['date'].to_numpy()
+        close = kline['close'].to_numpy(dtype=np.float64)
+        n = close.shape[0]
+        if n == 0:
+            return pd.DataFrame(columns=FEATURE_COLUMNS), []
+        outputs = {
+            name: np.empty(n, dtype=np.int8 if name.startswith('bb_break') else np.float64)
+            for name in INDICATOR_COLUMNS
+        }
+        calculated = np.zeros(n, dtype=bool)
+        start_day = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+        new_states = []
+        # Rows are ordered by stock_id, so each stock is one contiguous slice [begin, end)
+        bounds = np.flatnonzero(stock_ids[1:] != stock_ids[:-1]) + 1
+        for begin, end in zip(np.r_[0, bounds], np.r_[bounds, n]):
+            stock_id = stock_ids[begin]
+            state = states.get(stock_id)
+            if state is None:
+                features = compute_all(close[begin:end])
+                # Return rows from start_date on; the warm-up rows before it keep NULL EMA26/MACD DEA
+                first = begin
+                if start_day is not None:
+                    first += int(np.searchsorted(dates[begin:end], start_day, side='left'))
+            else:
+                # Skip rows already covered by the state
+                begin += int(np.searchsorted(dates[begin:end], state.last_date, side='right'))
+                if begin == end:
+                    continue
+                features = compute_from_state(
+                    close[begin:end], np.asarray(state.window20, dtype=np.float64),
+                    state.ema12, state.ema26, state.macd_dea
+                )
+                # Every row after the state is returned, which also fills days a skipped run missed
+                first = begin
+            for name, values in zip(INDICATOR_COLUMNS, features):
+                outputs[name][begin:end] = values
+            calculated[first:end] = True
+            new_state = self._next_state(stock_id, dates[end - 1], close[begin:end], features, state)
+            if new_state is not None:
+                new_states.append(new_state)
+
+        columns = {'stock_id': stock_ids[calculated], 'trade_date': dates[calculated]}
+        for name, values in outputs.items():
+            values = values[calculated]
+            if values.dtype == np.int8:
+                # Breakout flags: -1 (band undefined) becomes <NA> in a nullable boolean column
+                values = pd.arrays.BooleanArray(values == 1, values < 0)
+            columns[name] = values
+        columns['etl_run_id'] = str(self.etl_run_id)
+        columns['source_version'] = self.source_version
+        columns['commit_sha'] = self.commit_sha
+        return pd.DataFrame(columns, columns=FEATURE_COLUMNS), new_states
+
+    @staticmethod
+    def _warmup_start(start_date):
+        """
+        First kline date to fetch for a calculation without state that returns rows from start_date on.
+
+        Args:
+            start_date (str or None): Start date (YYYY-MM-DD)
+
+        Returns:
+            str or None: start_date minus WARMUP_CALENDAR_DAYS-1 days (YYYY-MM-DD), or None for no lower bound
+        """
+        if start_date is None:
+            return None
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d")
+        return (start_dt - timedelta(days=WARMUP_CALENDAR_DAYS-1)).strftime("%Y-%m-%d")
+
+    @staticmethod
+    def _is_state_usable(state, trade_date):
+        """
+        Check whether a stored indicator state can seed an incremental calculation up to trade_date.
+        States older than the WARMUP_CALENDAR_DAYS window (e.g., of suspended or delisted stocks)
+        are not used, so continuing them never fetches more kline than the warm-up calculation.
+
+        Args:
+            state (FeatureState or None): Stored state
+            trade_date (date): Date to calculate
+
+        Returns:
+            bool: True if the state is complete, strictly older than trade_date and
+                within the warm-up window before it
+        """
+        return (
+            state is not None
+            and trade_date - timedelta(days=WARMUP_CALENDAR_DAYS-1) <= state.last_date < trade_date
+            and state.ema12 is not None
+            and state.ema26 is not None
+            and state.macd_dea is not None
+            and len(state.window20) == BB_WINDOW
+        )
+
+    @staticmethod
+    def _next_state(stock_id, last_date, close, features, state=None):
+        """
+        Build the indicator state after the last row of one stock's calculation.
 
         Args:
             stock_id (str): Stock symbol
+            last_date (date): Trade date of the last calculated row
+            close (np.ndarray): Closes passed to the kernel, ordered by date ascending
+            features (tuple): Kernel output for close, in INDICATOR_COLUMNS order
+            state (FeatureState, optional): State the calculation started from
+
+        Returns:
+            dict or None: State dict for upsert_feature_states, or None if fewer than
+                BB_WINDOW closes are available or the EMAs are not seeded yet
+        """
+        history = list(state.window20) if state is not None else []
+        window = (history + close[-BB_WINDOW:].tolist())[-BB_WINDOW:]
+        last = {name: values[-1] for name, values in zip(INDICATOR_COLUMNS, features)}
+        if len(window) < BB_WINDOW or np.isnan(last['ema26']) or np.isnan(last['macd_dea']):
+            return None
+        return {
+            'stock_id': stock_id,
+            'last_date': last_date,
+            'ema12': float(last['ema12']),
+            'ema26': float(last['ema26']),
+            'macd_dea': float(last['macd_dea']),
+            'window20': window,
+        }
+
+    def _fetch_stock_chunk(self, stock_ids, start_date=None, end_date=None):
+        """
+        Fetch kline rows and usable indicator states for a chunk of stocks.
+
+        Args:
+            stock_ids (list): Stock symbols of the chunk
             start_date (str): Start date (YYYY-MM-DD)
             end_date (str): End date (YYYY-MM-DD)
 
         Returns:
-            list: List of dicts, each dict contains features for one day
+            tuple: (kline DataFrame with stock_id, date, close ordered by stock_id and date;
+                dict of usable FeatureState per stock_id), ready for _calculate_chunk
         """
-        max_window = 30
+        states = {}
+        # Usable states lie inside the warm-up window, so one fetch window covers every stock
+        fetch_start = self._warmup_start(start_date)
         if start_date == end_date and start_date is not None:
-            start_dt = datetime.strptime(start_date, "%Y-%m-%d")
-            start_date_adj = (start_dt - timedelta(days=max_window-1)).strftime("%Y-%m-%d")
-            logger.info(f"etl_by_stock: Fetching kline for {stock_id} from {start_date_adj} to {end_date} for feature calculation.")
-            kline_objs = get_kline(stock_id, start_date_adj, end_date)
-            logger.info(f"etl_by_stock: Fetched {len(kline_objs)} kline records for {stock_id}.")
-            df = pd.DataFrame([
-                {k: v for k, v in obj.__dict__.items() if not k.startswith('_')}
-                for obj in kline_objs
-            ]) if kline_objs else pd.DataFrame()
-        else:
-            logger.info(f"etl_by_stock: Fetching kline for {stock_id} from {start_date} to {end_date} for feature calculation.")
-            kline_objs = get_kline(stock_id, start_date, end_date)
-            logger.info(f"etl_by_stock: Fetched {len(kline_objs)} kline records for {stock_id}.")
-            df = pd.DataFrame([
-                {k: v for k, v in obj.__dict__.items() if not k.startswith('_')}
-                for obj in kline_objs
-            ]) if kline_objs else pd.DataFrame()
-        if df.empty:
-            logger.warning(f"etl_by_stock: No kline data for {stock_id}, skipped.")
-            return []
-        df = self.calculate_features(stock_id, df)
-        result = []
-        for _, row in df.iterrows():
-            result.append({
-                'stock_id': stock_id,
-                'trade_date': row['date'],
-                'ma5': None if pd.isnull(row.get('ma5')) else row.get('ma5'),
-                'ema12': None if pd.isnull(row.get('ema12')) else row.get('ema12'),
-                'ema26': None if pd.isnull(row.get('ema26')) else row.get('ema26'),
-                'macd_dif': None if pd.isnull(row.get('macd_dif')) else row.get('macd_dif'),
-                'macd_dea': None if pd.isnull(row.get('macd_dea')) else row.get('macd_dea'),
-                'macd_osc': None if pd.isnull(row.get('macd_osc')) else row.get('macd_osc'),
-                'bb_ma20': None if pd.isnull(row.get('bb_ma20')) else row.get('bb_ma20'),
-                'bb_std20': None if pd.isnull(row.get('bb_std20')) else row.get('bb_std20'),
-                'bb_upper20': None if pd.isnull(row.get('bb_upper20')) else row.get('bb_upper20'),
-                'bb_lower20': None if pd.isnull(row.get('bb_lower20')) else row.get('bb_lower20'),
-                'bb_width20': None if pd.isnull(row.get('bb_width20')) else row.get('bb_width20'),
-                'bb_pos20': None if pd.isnull(row.get('bb_pos20')) else row.get('bb_pos20'),
-                'bb_break_up': bool(row.get('bb_break_up')) if not pd.isnull(row.get('bb_break_up')) else None,
-                'bb_break_dn': bool(row.get('bb_break_dn')) if not pd.isnull(row.get('bb_break_dn')) else None,
-                'etl_run_id': str(self.etl_run_id),
-                'source_version': self.source_version,
-                'commit_sha': self.commit_sha,
-                'created_at': datetime.now(),
-                'updated_at': datetime.now(),
-            })
-        logger.info(f"etl_by_stock: Feature calculation for {stock_id} {end_date} finished, total {len(result)} rows.")
-        return result
+            trade_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            states = {
+                sid: state for sid, state in get_feature_states(stock_ids, session=self.session).items()
+                if self._is_state_usable(state, trade_date)
+            }
+        big_df = get_kline_multi(stock_ids, fetch_start, end_date, columns=KLINE_COLUMNS, session=self.session)
+        logger.debug("_fetch_stock_chunk: Fetched {} kline records for {} stocks.", len(big_df), len(stock_ids))
+        return big_df, states
+
+    def _etl_stock_ids(self, stock_ids, start_date=None, end_date=None):
+        """
+        Batch ETL over an iterable of stock ids.
+        Ids are consumed in chunks of ETL_FETCH_CHUNK_SIZE; each chunk's kline rows are fetched with
+        one query and calculated with _calculate_chunk into one DataFrame per chunk.
+
+        Args:
+            stock_ids (Iterable[str]): Stock symbols, may be a lazy stream
+            start_date (str): Start date (YYYY-MM-DD)
+            end_date (str): End date (YYYY-MM-DD)
+
+        Returns:
+            pd.DataFrame: One row per stock and day with FEATURE_COLUMNS, NaN marks NULL values
+        """
+        stock_id_iter = iter(stock_ids)
+        frames = []
+        new_states = []
+        while True:
+            chunk = list(islice(stock_id_iter, ETL_FETCH_CHUNK_SIZE))
+            if not chunk:
+                break
+            kline, states = self._fetch_stock_chunk(chunk, start_date, end_date)
+            frame, chunk_states = self._calculate_chunk(kline, states, start_date)
+            frames.append(frame)
+            new_states.extend(chunk_states)
+        # States are written after the stock id stream is exhausted, so the stream's server-side
+        # cursor is never interleaved with writes. With a shared session they are left uncommitted
+        # and committed together with the feature rows by bulk_upsert_frame.
+        upsert_feature_states(new_states, session=self.session)
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=FEATURE_COLUMNS)
 
     def etl_all_stocks(self, start_date=None, end_date=None):
         """
-        Batch ETL for all stocks: fetch kline, calculate features, prepare dicts for upsert.
+        Batch ETL for all stocks: fetch kline, calculate features, prepare a DataFrame for upsert.
+        Stock ids are streamed from the database and processed in chunks (see _etl_stock_ids).
+        Like etl_by_stock, single-day runs advance stored indicator states where available.
 
         Args:
             start_date (str): Start date (YYYY-MM-DD)
             end_date (str): End date (YYYY-MM-DD)
 
         Returns:
-            list: List of dicts for all stocks and dates
+            pd.DataFrame: One row per stock and day with FEATURE_COLUMNS, NaN marks NULL values
         """
-        stock_ids = get_all_stock_ids()
-        all_results = []
         logger.info(f"etl_all_stocks: Batch feature calculation for all stocks, date range {start_date} ~ {end_date}.")
-        for stock_id in stock_ids:
-            result = self.etl_by_stock(stock_id, start_date, end_date)
-            all_results.extend(result)
+        all_results = self._etl_stock_ids(get_all_stock_ids(session=self.session), start_date, end_date)
         logger.info(f"etl_all_stocks: Batch feature calculation finished, total {len(all_results)} rows.")
         return all_results
+
+    def etl_by_stocks(self, stock_ids, start_date=None, end_date=None):
+        """
+        Batch ETL for a given list of stocks, with one kline query per chunk instead of one per stock.
+        Repeated stock ids are processed once.
+        Like etl_by_stock, single-day runs advance stored indicator states where available.
+
+        Args:
+            stock_ids (list): Stock symbols
+            start_date (str): Start date (YYYY-MM-DD)
+            end_date (str): End date (YYYY-MM-DD)
+
+        Returns:
+            pd.DataFrame: One row per stock and day with FEATURE_COLUMNS, NaN marks NULL values
+        """
+        # Repeated ids would put the same (stock_id, trade_date) and state twice into one upsert,
+        # which ON CONFLICT DO UPDATE rejects; keep the first occurrence of each
+        stock_ids = list(dict.fromkeys(stock_ids))
+        logger.info(f"etl_by_stocks: Batch feature calculation for {len(stock_ids)} stocks, date range {start_date} ~ {end_date}.")
+        all_results = self._etl_stock_ids(stock_ids, start_date, end_date)
+        logger.info(f"etl_by_stocks: Batch feature calculation finished, total {len(all_results)} rows.")
+        return all_results
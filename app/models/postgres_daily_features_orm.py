@@ -1,12 +1,35 @@
-from sqlalchemy import Column, String, Date, Double, Boolean, TIMESTAMP
+import io
+import pandas as pd
+from sqlalchemy import Column, String, Date, Double, Boolean, TIMESTAMP, func
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID, insert
-from app.db.postgres import SessionLocal
+from app.db.postgres import session_scope
 from app.core.logger import logger
 from sqlalchemy.ext.declarative import declarative_base
 from app.core.setups import settings
 
 Base = declarative_base()
 
+# Rows serialized per COPY chunk in bulk_upsert_frame
+COPY_CHUNK_SIZE = 50000
+
+# Upserts with fewer rows use the cached UPSERT_STMT (executemany) instead of COPY,
+# which saves the staging-table round trips on small per-stock calls
+COPY_MIN_ROWS = 1000
+
+def frame_to_records(df):
+    """
+    Convert a feature DataFrame into a list of row dicts with NaN/<NA> replaced by None (SQL NULL / JSON null).
+
+    Args:
+        df (pd.DataFrame): Feature DataFrame, columns named after table columns
+
+    Returns:
+        list: List of dicts, one per row
+    """
+    # Cast to object first so NaN can be replaced by None column-wise
+    df = df.astype(object)
+    return df.where(df.notna(), None).to_dict(orient='records')
+
 class FeatureDaily(Base):
     table_name = getattr(settings, "POSTGRES_TABLE", "daily_features_etl")
     __tablename__ = table_name
@@ -53,17 +76,67 @@ class FeatureDaily(Base):
     etl_run_id = Column(PG_UUID, nullable=False)
     source_version = Column(String)
     commit_sha = Column(String)
-    created_at = Column(TIMESTAMP)
-    updated_at = Column(TIMESTAMP)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now())
 
     @classmethod
-    def bulk_upsert_to_db(cls, dict_list):
+    def bulk_upsert_to_db(cls, dict_list, session=None):
         """
         Bulk upsert a list of feature dicts into the feature_daily table.
-        Uses PostgreSQL ON CONFLICT DO UPDATE for efficient batch insert/update.
+        Thin wrapper around bulk_upsert_frame for callers holding row dicts.
 
         Args:
             dict_list (list): List of dicts, each dict contains feature values for one day/stock
+            session (Session, optional): Session to reuse; a new one is opened if None
+
+        Returns:
+            int: Number of rows upserted
+        """
+        if not dict_list:
+            logger.info("bulk_upsert_to_db: input dict_list is empty, nothing to upsert.")
+            return 0
+        if len(dict_list) < COPY_MIN_ROWS:
+            return cls._upsert_rows(dict_list, session=session)
+        return cls.bulk_upsert_frame(pd.DataFrame(dict_list), session=session)
+
+    @classmethod
+    def _upsert_rows(cls, rows, session=None):
+        """
+        Upsert row dicts with the module-level UPSERT_STMT as one executemany call.
+        The statement object is built once, so SQLAlchemy reuses its compiled SQL across calls.
+
+        Args:
+            rows (list): List of dicts keyed by table column names; None is written as NULL
+            session (Session, optional): Session to reuse; a new one is opened if None
+
+        Returns:
+            int: Number of rows upserted
+        """
+        with session_scope(session) as session:
+            try:
+                result = session.execute(UPSERT_STMT, rows)
+                session.commit()
+                rowcount = result.rowcount if result.rowcount >= 0 else len(rows)
+                logger.info(f"bulk_upsert_to_db: upserted {rowcount} rows into feature_daily table.")
+                return rowcount
+            except Exception as e:
+                session.rollback()
+                logger.error(f"bulk_upsert_to_db: upsert failed: {e}")
+                raise e
+
+    @classmethod
+    def bulk_upsert_frame(cls, df, session=None):
+        """
+        Bulk upsert a columnar feature DataFrame into the feature_daily table.
+        Rows are streamed with COPY into a temporary staging table, then merged into the target table
+        with a single INSERT ... SELECT ... ON CONFLICT DO UPDATE, all in one transaction.
+        created_at/updated_at are stamped by the database; updated_at is refreshed on conflict.
+        Any number of rows can be passed at once; COPY is fed in chunks of COPY_CHUNK_SIZE rows.
+        Inputs smaller than COPY_MIN_ROWS go through the cached UPSERT_STMT instead.
+
+        Args:
+            df (pd.DataFrame): One row per day/stock, columns named after table columns; NaN/None is written as NULL
+            session (Session, optional): Session to reuse; a new one is opened if None
 
         Returns:
             int: Number of rows upserted
@@ -74,28 +147,61 @@ class FeatureDaily(Base):
         Logging:
             Logs info for empty input, success, and error cases
         """
-        if not dict_list:
-            logger.info("bulk_upsert_to_db: input dict_list is empty, nothing to upsert.")
+        if df.empty:
+            logger.info("bulk_upsert_frame: input DataFrame is empty, nothing to upsert.")
             return 0
-        session = SessionLocal()
-        try:
-            stmt = insert(cls).values(dict_list)
-            update_dict = {
-                col: getattr(stmt.excluded, col)
-                for col in dict_list[0].keys()
-                if col not in ["stock_id", "trade_date"]
-            }
-            stmt = stmt.on_conflict_do_update(
-                index_elements=["stock_id", "trade_date"],
-                set_=update_dict
-            )
-            result = session.execute(stmt)
-            session.commit()
-            logger.info(f"bulk_upsert_to_db: upserted {result.rowcount} rows into feature_daily table.")
-            return result.rowcount
-        except Exception as e:
-            session.rollback()
-            logger.error(f"bulk_upsert_to_db: upsert failed: {e}")
-            raise e
-        finally:
-            session.close()
+        if len(df) < COPY_MIN_ROWS:
+            return cls._upsert_rows(frame_to_records(df), session=session)
+        columns = list(df.columns)
+        col_sql = ", ".join(columns)
+        update_sql = ", ".join(
+            [f"{col} = EXCLUDED.{col}" for col in columns if col not in ["stock_id", "trade_date", "created_at", "updated_at"]]
+            + ["updated_at = NOW()"]
+        )
+        staging_table = f"stg_{cls.__tablename__}"
+
+        with session_scope(session) as session:
+            try:
+                # COPY needs the DBAPI (psycopg2) connection behind the session's transaction
+                conn = session.connection().connection
+                with conn.cursor() as cur:
+                    cur.execute(
+                        f"CREATE TEMP TABLE {staging_table} (LIKE {cls.__tablename__} INCLUDING DEFAULTS) ON COMMIT DROP"
+                    )
+                    # Stream rows in chunks to bound the CSV buffer size; all chunks share one transaction
+                    for start in range(0, len(df), COPY_CHUNK_SIZE):
+                        # CSV is written column-wise by pandas; missing values become unquoted
+                        # empty fields, which COPY reads as NULL
+                        buf = io.StringIO()
+                        df.iloc[start:start + COPY_CHUNK_SIZE].to_csv(buf, index=False, header=False)
+                        buf.seek(0)
+                        cur.copy_expert(f"COPY {staging_table} ({col_sql}) FROM STDIN WITH (FORMAT csv)", buf)
+                    cur.execute(
+                        f"INSERT INTO {cls.__tablename__} ({col_sql}) "
+                        f"SELECT {col_sql} FROM {staging_table} "
+                        f"ON CONFLICT (stock_id, trade_date) DO UPDATE SET {update_sql}"
+                    )
+                    rowcount = cur.rowcount
+                session.commit()
+                logger.info(f"bulk_upsert_frame: upserted {rowcount} rows into feature_daily table.")
+                return rowcount
+            except Exception as e:
+                session.rollback()
+                logger.error(f"bulk_upsert_frame: upsert failed: {e}")
+                raise e
+
+
+# Upsert statement shared by all small-batch calls; executed with a list of row dicts (executemany).
+# created_at keeps its insert-time value and updated_at is refreshed on conflict.
+_insert = insert(FeatureDaily.__table__)
+UPSERT_STMT = _insert.on_conflict_do_update(
+    index_elements=["stock_id", "trade_date"],
+    set_={
+        **{
+            col.name: _insert.excluded[col.name]
+            for col in FeatureDaily.__table__.columns
+            if col.name not in ["stock_id", "trade_date", "created_at", "updated_at"]
+        },
+        "updated_at": func.now(),
+    },
+)
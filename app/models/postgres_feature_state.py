@@ -0,0 +1,109 @@
+from sqlalchemy import Column, String, Date, Double, TIMESTAMP, func
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import declarative_base
+from app.core.setups import settings
+from app.core.logger import logger
+from app.db.postgres import session_scope
+
+Base = declarative_base()
+
+class FeatureState(Base):
+    """
+    SQLAlchemy ORM class for the incremental indicator state table.
+
+    Each row holds the recursive indicator state of one stock after its last calculated trade date,
+    so single-day ETL can advance the indicators from the new kline rows only instead of
+    recomputing them over the whole history.
+
+    Table columns:
+        - stock_id (String): Stock symbol, primary key
+        - last_date (Date): Last trade date included in the state
+        - ema12, ema26 (Double): 12/26-day EMA values on last_date
+        - macd_dea (Double): MACD signal line value on last_date
+        - window20 (Double[]): Last 20 closes up to last_date, oldest first
+        - updated_at (TIMESTAMP): Record timestamp
+
+    Usage:
+        Table name is configurable via settings.POSTGRES_FEATURE_STATE.
+    """
+    __tablename__ = getattr(settings, "POSTGRES_FEATURE_STATE", "daily_features_state")
+    stock_id = Column(String, primary_key=True)
+    last_date = Column(Date, nullable=False)
+    ema12 = Column(Double)
+    ema26 = Column(Double)
+    macd_dea = Column(Double)
+    window20 = Column(ARRAY(Double), nullable=False)
+    updated_at = Column(TIMESTAMP, server_default=func.now())
+
+def get_feature_state(stock_id, session=None):
+    """
+    Fetch the incremental indicator state for a stock.
+
+    Args:
+        stock_id (str): Stock symbol to query
+        session (Session, optional): Session to reuse; a new one is opened if None
+
+    Returns:
+        FeatureState or None: State row, or None if the stock has no state yet
+    """
+    with session_scope(session) as session:
+        return session.get(FeatureState, stock_id)
+
+def get_feature_states(stock_ids, session=None):
+    """
+    Fetch the incremental indicator states for many stocks in one query.
+
+    Args:
+        stock_ids (list): Stock symbols to query
+        session (Session, optional): Session to reuse; a new one is opened if None
+
+    Returns:
+        dict: Mapping of stock_id to FeatureState, stocks without state are absent
+    """
+    with session_scope(session) as session:
+        rows = session.query(FeatureState).filter(FeatureState.stock_id.in_(list(stock_ids))).all()
+        return {row.stock_id: row for row in rows}
+
+def upsert_feature_states(state_list, session=None):
+    """
+    Insert or update incremental indicator states.
+    An existing state is only replaced by one with the same or a later last_date,
+    so recalculating an older date range never rewinds the state.
+
+    With a caller-owned session the upsert is left uncommitted, so the state is committed
+    in the same transaction as the feature rows it belongs to (see FeatureDaily.bulk_upsert_frame)
+    and rolled back with them on failure. Without a session the upsert is committed here.
+
+    Args:
+        state_list (list): List of dicts with keys stock_id, last_date, ema12, ema26, macd_dea, window20
+        session (Session, optional): Session to reuse; a new one is opened and committed if None
+
+    Returns:
+        int: Number of rows inserted or updated
+    """
+    if not state_list:
+        return 0
+    owns_session = session is None
+    with session_scope(session) as session:
+        try:
+            stmt = insert(FeatureState).values(state_list)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["stock_id"],
+                set_={
+                    "last_date": stmt.excluded.last_date,
+                    "ema12": stmt.excluded.ema12,
+                    "ema26": stmt.excluded.ema26,
+                    "macd_dea": stmt.excluded.macd_dea,
+                    "window20": stmt.excluded.window20,
+                    "updated_at": func.now(),
+                },
+                where=FeatureState.last_date <= stmt.excluded.last_date,
+            )
+            result = session.execute(stmt)
+            if owns_session:
+                session.commit()
+            return result.rowcount
+        except Exception as e:
+            session.rollback()
+            logger.error(f"upsert_feature_states: upsert failed: {e}")
+            raise e
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String, Date, Float, Integer, BigInteger
+import pandas as pd
+from sqlalchemy import Column, String, Date, Float, Integer, BigInteger, Index, select
 from sqlalchemy.orm import declarative_base
 from app.core.setups import settings
-from app.db.postgres import engine, SessionLocal
+from app.db.postgres import session_scope
 
 Base = declarative_base()
 
@@ -39,33 +40,64 @@ class PostgresKline(Base):
     spread = Column(Float)
     trading_turnover = Column(BigInteger)
     __table_args__ = (
-        # UNIQUE constraint for (date, stock_id)
+        # Composite index for stock_id + date range scans (created at startup by ensure_kline_indexes)
+        Index('ix_kline_stock_date', 'stock_id', 'date'),
         {'sqlite_autoincrement': True},
     )
 
-def get_kline(stock_id, start_date=None, end_date=None):
+def get_kline(stock_id, start_date=None, end_date=None, columns=('date', 'close'), session=None):
     """
     Query kline (OHLCV) data for a given stock_id and date range from the database.
+    Uses a Core SELECT of only the requested columns, read straight into a DataFrame,
+    so no ORM objects are materialized.
 
     Args:
         stock_id (str): Stock symbol to query
         start_date (str or date, optional): Start date (inclusive)
         end_date (str or date, optional): End date (inclusive)
+        columns (tuple, optional): PostgresKline column names to select, default ('date', 'close')
+        session (Session, optional): Session to reuse; a new one is opened if None
 
     Returns:
-        list: List of PostgresKline ORM objects, ordered by date ascending
+        pd.DataFrame: One row per trade day with the requested columns, ordered by date ascending
 
     Usage:
         Used in ETL pipeline to fetch raw kline data for feature calculation.
     """
-    session = SessionLocal()
-    try:
-        query = session.query(PostgresKline).filter(PostgresKline.stock_id == stock_id)
-        if start_date:
-            query = query.filter(PostgresKline.date >= start_date)
-        if end_date:
-            query = query.filter(PostgresKline.date <= end_date)
-        query = query.order_by(PostgresKline.date.asc())
-        return query.all()
-    finally:
-        session.close()
+    stmt = select(*[getattr(PostgresKline, c) for c in columns]).where(PostgresKline.stock_id == stock_id)
+    if start_date:
+        stmt = stmt.where(PostgresKline.date >= start_date)
+    if end_date:
+        stmt = stmt.where(PostgresKline.date <= end_date)
+    stmt = stmt.order_by(PostgresKline.date.asc())
+    with session_scope(session) as session:
+        return pd.read_sql_query(stmt, session.connection())
+
+def get_kline_multi(stock_ids=None, start_date=None, end_date=None, columns=('date', 'close'), session=None):
+    """
+    Query kline data for many stocks in a single round trip.
+    Only stock_id plus the requested columns are selected, so unused OHLCV columns stay off the wire.
+
+    Args:
+        stock_ids (list, optional): Stock symbols to query; all stocks if None
+        start_date (str or date, optional): Start date (inclusive)
+        end_date (str or date, optional): End date (inclusive)
+        columns (tuple, optional): PostgresKline column names to select besides stock_id, default ('date', 'close')
+        session (Session, optional): Session to reuse; a new one is opened if None
+
+    Returns:
+        pd.DataFrame: Columns stock_id plus the requested columns, ordered by stock_id and date ascending
+
+    Usage:
+        Used in batch ETL to fetch every stock's kline at once, then split with groupby('stock_id').
+    """
+    stmt = select(PostgresKline.stock_id, *[getattr(PostgresKline, c) for c in columns if c != 'stock_id'])
+    if stock_ids is not None:
+        stmt = stmt.where(PostgresKline.stock_id.in_(list(stock_ids)))
+    if start_date:
+        stmt = stmt.where(PostgresKline.date >= start_date)
+    if end_date:
+        stmt = stmt.where(PostgresKline.date <= end_date)
+    stmt = stmt.order_by(PostgresKline.stock_id.asc(), PostgresKline.date.asc())
+    with session_scope(session) as session:
+        return pd.read_sql_query(stmt, session.connection())
@@ -1,12 +1,12 @@
 
 # postgres_stock_info.py
 # SQLAlchemy ORM model and utility function for Taiwan stock info table.
-# This module defines the table schema and provides a function to fetch all stock IDs.
+# This module defines the table schema and provides a generator streaming all stock IDs.
 
-from sqlalchemy import Column, String
+from sqlalchemy import Column, String, select
 from sqlalchemy.orm import declarative_base
 from app.core.setups import settings
-from app.db.postgres import engine, SessionLocal
+from app.db.postgres import session_scope
 
 # Base class for SQLAlchemy ORM models
 Base = declarative_base()
@@ -21,17 +21,16 @@ class PostgresStockInfo(Base):
     stock_id = Column(String, primary_key=True)  # Stock symbol (e.g., '2330')
     # Extend with additional columns as needed (e.g., stock_name, industry_category)
 
-def get_all_stock_ids():
+def get_all_stock_ids(session=None):
     """
-    Fetch all stock_id values from the stock info table.
-    This function queries the table and returns a list of all stock symbols.
+    Stream all stock_id values from the stock info table.
+    Rows are fetched through a server-side cursor in batches of 1000, so the whole
+    table is never materialized at once.
+    Args:
+        session (Session, optional): Session to reuse; a new one is opened if None
     Returns:
-        list: List of stock_id strings present in the table.
+        Iterator[str]: Generator of stock_id strings present in the table.
     """
-    session = SessionLocal()
-    try:
-        results = session.query(PostgresStockInfo.stock_id).all()
-        # Extract stock_id from each row and return as a list
-        return [row.stock_id for row in results]
-    finally:
-        session.close()
+    with session_scope(session) as session:
+        stmt = select(PostgresStockInfo.stock_id).execution_options(yield_per=1000)
+        yield from session.execute(stmt).scalars()